@@ -0,0 +1,39 @@
+from app import app, _SEARCH_DEEP
+
+# Three pickup/delivery pairs around central Berlin with generous, staggered
+# windows, so a feasible route clearly exists
+_PAYLOAD = [
+    {'id': 'a-pickup', 'coordinates': {'lat': 52.5200, 'lng': 13.4050},
+     'pickup': '2024-05-01T10:00:00Z', 'delivery': '2024-05-01T11:00:00Z'},
+    {'id': 'a-delivery', 'coordinates': {'lat': 52.5166, 'lng': 13.3880},
+     'pickup': '2024-05-01T10:00:00Z', 'delivery': '2024-05-01T11:00:00Z'},
+    {'id': 'b-pickup', 'coordinates': {'lat': 52.5246, 'lng': 13.4026},
+     'pickup': '2024-05-01T10:30:00Z', 'delivery': '2024-05-01T11:30:00Z'},
+    {'id': 'b-delivery', 'coordinates': {'lat': 52.5108, 'lng': 13.4455},
+     'pickup': '2024-05-01T10:30:00Z', 'delivery': '2024-05-01T11:30:00Z'},
+    {'id': 'c-pickup', 'coordinates': {'lat': 52.5321, 'lng': 13.4246},
+     'pickup': '2024-05-01T11:00:00Z', 'delivery': '2024-05-01T12:00:00Z'},
+    {'id': 'c-delivery', 'coordinates': {'lat': 52.5069, 'lng': 13.3762},
+     'pickup': '2024-05-01T11:00:00Z', 'delivery': '2024-05-01T12:00:00Z'},
+]
+
+def test_optimize_route_returns_every_request():
+    client = app.test_client()
+    response = client.post('/optimize_route', json=_PAYLOAD)
+    assert response.status_code == 200
+    route = response.get_json()
+    assert sorted(r['id'] for r in route) == sorted(r['id'] for r in _PAYLOAD)
+
+def test_optimize_route_deep_returns_every_request():
+    # Guided local search always runs out its clock, so give the deep solve a
+    # test-sized budget instead of the production 30 seconds
+    original_limit = _SEARCH_DEEP.time_limit.seconds
+    _SEARCH_DEEP.time_limit.seconds = 2
+    try:
+        client = app.test_client()
+        response = client.post('/optimize_route?deep=1', json=_PAYLOAD)
+        assert response.status_code == 200
+        route = response.get_json()
+        assert sorted(r['id'] for r in route) == sorted(r['id'] for r in _PAYLOAD)
+    finally:
+        _SEARCH_DEEP.time_limit.seconds = original_limit